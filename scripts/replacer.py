@@ -1,14 +1,44 @@
-import os
+import hashlib
+import shutil
 import zipfile
+from pathlib import Path
 
 
-os.replace("./global_data.csv", "../data/global_data.csv")
+# All the files are relative to the scripts folder.
+WORK_DIR = Path(".")
+DATA_DIR = Path("../data")
+
+GLOBAL_FILE = WORK_DIR / "global_data.csv"
+MX_FILE = WORK_DIR / "mx_data.csv"
+MX_ZIP_FILE = WORK_DIR / "mx_data.zip"
+HASH_FILE = WORK_DIR / ".mx_data.csv.sha256"
+
+shutil.move(GLOBAL_FILE, DATA_DIR / GLOBAL_FILE.name)
 print("Replaced global file.")
 
-with zipfile.ZipFile("./mx_data.zip", "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
-    print("Compressing Mexico file.")
-    zip_file.write("mx_data.csv")
+# We compare the new Mexico file against the hash of the last one we compressed.
+csv_hash = hashlib.sha256()
+
+with MX_FILE.open("rb") as csv_file:
+
+    for chunk in iter(lambda: csv_file.read(1024 * 1024), b""):
+        csv_hash.update(chunk)
+
+csv_hash = csv_hash.hexdigest()
+
+previous_hash = HASH_FILE.read_text().strip() if HASH_FILE.exists() else None
+
+if csv_hash == previous_hash:
+    print("Mexico file is unchanged.")
+else:
+    # The lowest compression level is much faster and barely affects the size of a CSV file.
+    with zipfile.ZipFile(MX_ZIP_FILE, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
+        print("Compressing Mexico file.")
+
+        zip_file.write(MX_FILE, MX_FILE.name)
+
+    shutil.move(MX_ZIP_FILE, DATA_DIR / MX_ZIP_FILE.name)
+    HASH_FILE.write_text(csv_hash)
+    print("Replaced Mexico file.")
 
-os.replace("./mx_data.zip", "../data/mx_data.zip")
-os.remove("./mx_data.csv")
-print("Replaced Mexico file.")
+MX_FILE.unlink()
@@ -2,9 +2,10 @@
 This script downloads the Johns Hopkins COVID-19 time series datasets and merges them into one CSV file.
 """
 
-import csv
-from datetime import datetime
+import io
+from concurrent.futures import ThreadPoolExecutor
 
+import pandas as pd
 import requests
 
 CSV_FILES = {
@@ -13,105 +14,73 @@ CSV_FILES = {
     "recovered": "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv"
 }
 
+# A single session lets urllib3 reuse the connection to raw.githubusercontent.com.
+SESSION = requests.Session()
+
 
 def main():
-    """Prepares our data structures and parses the original CSV files."""
+    """Downloads the original CSV files and merges them into one long-form dataset."""
 
-    # Start by generating a skeleton dict and getting all the available dates.
-    data_dict, dates_dict = generate_list()
+    # This dict will hold one long-form DataFrame for each CSV data kind.
+    frames = dict()
 
-    # Iterate over our 3 urls.
-    for kind, url in CSV_FILES.items():
+    # Download our 3 urls in parallel.
+    with ThreadPoolExecutor(max_workers=len(CSV_FILES)) as pool:
+        texts = list(pool.map(download, CSV_FILES.values()))
 
-        with requests.get(url) as response:
+    for kind, text in zip(CSV_FILES, texts):
 
-            # Pass the response text into a csv.DictReader object.
-            reader = csv.DictReader(response.text.splitlines())
+        # Pass the CSV text into a DataFrame and drop the columns we don't need.
+        df = pd.read_csv(io.StringIO(text)).drop(
+            columns=["Province/State", "Lat", "Long"])
 
-            # Iterate over each row of the CSV file.
-            for row in reader:
+        # Combine all the provinces/states of each country/region.
+        df = df.groupby("Country/Region", as_index=False).sum()
 
-                # Iterate over our available dates.
-                for k, v in dates_dict.items():
+        # Convert the header row dates to ISO dates, this parses each date only once.
+        df.columns = ["Country/Region", *pd.to_datetime(
+            df.columns[1:], format="%m/%d/%y").strftime("%Y-%m-%d")]
 
-                    # Construct the key for our look up.
-                    temp_key = "{}_{}".format(v, row["Country/Region"])
+        # Convert the date columns into rows, one for each country and date.
+        frames[kind] = df.melt(id_vars="Country/Region",
+                               var_name="isodate", value_name=kind)
 
-                    # Update the corresponding value depending on the CSV data kind.
-                    if kind == "confirmed":
-                        data_dict[temp_key][0] += int(row[k])
-                    elif kind == "deaths":
-                        data_dict[temp_key][1] += int(row[k])
-                    elif kind == "recovered":
-                        data_dict[temp_key][2] += int(row[k])
+    # Merge the 3 DataFrames using the date and country as our key.
+    merged_df = frames["confirmed"]
 
-    # Save our data to a CSV file.
-    with open("global_data.csv", "w", encoding="utf-8", newline="") as other_file:
+    for kind in ["deaths", "recovered"]:
+        merged_df = merged_df.merge(
+            frames[kind], on=["isodate", "Country/Region"], how="outer")
 
-        # Initialize the data list with the header row.
-        data_list = [
-            ["isodate", "country", "confirmed", "deaths", "recovered"]]
+    # Fill the missing values with zeros and sort by date and country.
+    merged_df[list(CSV_FILES)] = merged_df[list(CSV_FILES)].fillna(0).astype(int)
+    merged_df = merged_df.rename(columns={"Country/Region": "country"})
+    merged_df = merged_df.sort_values(["isodate", "country"])
 
-        # Iterate over our data dict and pass the values to the data list.
-        for k, v in data_dict.items():
-            isodate, country = k.split("_")
-            data_list.append([isodate, country, v[0], v[1], v[2]])
+    # Save our data to a CSV file, a 1 MB buffer reduces the number of write calls.
+    # The published file uses the CRLF line endings of the csv module on every platform.
+    with open("global_data.csv", "w", encoding="utf-8", newline="", buffering=1024 * 1024) as other_file:
+        merged_df.to_csv(other_file, index=False, lineterminator="\r\n", columns=[
+                         "isodate", "country", "confirmed", "deaths", "recovered"])
 
-        csv.writer(other_file).writerows(data_list)
 
+def download(url):
+    """Downloads the specified CSV file using the shared session.
 
-def generate_list():
-    """Prepares a list with all the available countries and all the available dates.
-    This list will contain dummy values that will be later filled.
+    Parameters
+    ----------
+    url : str
+        The url of the CSV file.
 
     Returns
     -------
-    tup
-        A tuple containing a skeleton list and a dict with the date strings and their datetime objects.
+    str
+        The contents of the CSV file.
 
     """
 
-    # Initialize the skeleton dict.
-    data_dict = dict()
-
-    # This dictionary will hold all our available dates.
-    dates_dict = dict()
-
-    # This set will hold all the countries/regions we find.
-    countries = set()
-
-    # We will load the first CSV url.
-    file = list(CSV_FILES.values())[0]
-
-    with requests.get(file) as response:
-
-        # Pass the response text into a csv.DictReader object.
-        reader = csv.DictReader(response.text.splitlines())
-
-        # Extract the header row and select from the fifth column onwards.
-        fields = reader.fieldnames[4:]
-
-        # Convert the header row dates to datetime objects.
-        for field in fields:
-            dates_dict[field] = "{:%Y-%m-%d}".format(
-                datetime.strptime(field, "%m/%d/%y"))
-
-        # Extract the countries/regions by iterating over all rows.
-        for row in reader:
-            countries.add(row["Country/Region"])
-
-        # Convert the countries set to a list and sort it.
-        countries = sorted(list(countries))
-
-        # Combine every date with every country and fill it with zero values.
-        for date in dates_dict.values():
-
-            for country in countries:
-
-                temp_key = "{}_{}".format(date, country)
-                data_dict[temp_key] = [0, 0, 0]
-
-        return data_dict, dates_dict
+    with SESSION.get(url) as response:
+        return response.text
 
 
 if __name__ == "__main__":
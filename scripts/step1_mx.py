@@ -3,13 +3,18 @@ This script downloads the Mexican dataset and its catalog.
 It then merges them and cleans them into a new dataset.
 """
 
-import csv
-import io
+import hashlib
+import json
 import os
+import shutil
+import tempfile
 import zipfile
+from collections import defaultdict
 
+import numpy as np
+import pandas as pd
 import requests
-from openpyxl import load_workbook
+from python_calamine import CalamineWorkbook
 
 
 DATA_URL = "http://datosabiertos.salud.gob.mx/gobmx/salud/datos_abiertos/datos_abiertos_covid19.zip"
@@ -17,6 +22,13 @@ DATA_FILE = "./data.zip"
 
 CATALOG_URL = "http://epidemiologia.salud.gob.mx/gobmx/salud/datos_abiertos/diccionario_datos_covid19.zip"
 CATALOG_FILE = "./catalog.zip"
+CATALOG_CACHE_FILE = "./catalog_cache.json"
+
+# The buffer size used when streaming the downloads to disk.
+CHUNK_SIZE = 256 * 1024
+
+# The number of rows from the Mexican CSV file processed at once.
+CSV_CHUNK_ROWS = 500_000
 
 # These will hold the values from the catalog workbook.
 ORIGEN_DICT = dict()
@@ -30,14 +42,55 @@ ENTIDADES_DICT = dict()
 MUNICIPIOS_DICT = dict()
 CLASIFICACION_FINAL_DICT = dict()
 
-# Used to fix encoding issues.
-FIXERS = {
-    "Ã±": "ñ",
-    "Ã¡": "á",
-    "Ã©": "é",
-    "Ã³": "ó",
-    "Ãº": "ú",
-    "Ã": "í"
+# All the catalog dicts by name, used for caching them.
+CATALOGS = {
+    "ORIGEN": ORIGEN_DICT,
+    "SECTOR": SECTOR_DICT,
+    "SEXO": SEXO_DICT,
+    "TIPO_PACIENTE": TIPO_PACIENTE_DICT,
+    "SI_NO": SI_NO_DICT,
+    "NACIONALIDAD": NACIONALIDAD_DICT,
+    "RESULTADO_LAB": RESULTADO_LAB_DICT,
+    "ENTIDADES": ENTIDADES_DICT,
+    "MUNICIPIOS": MUNICIPIOS_DICT,
+    "CLASIFICACION_FINAL": CLASIFICACION_FINAL_DICT
+}
+
+# The CSV columns and the catalog used to translate their values.
+CATALOG_COLUMNS = {
+    "ENTIDAD_UM": ENTIDADES_DICT,
+    "ENTIDAD_NAC": ENTIDADES_DICT,
+    "ENTIDAD_RES": ENTIDADES_DICT,
+    "ORIGEN": ORIGEN_DICT,
+    "SECTOR": SECTOR_DICT,
+    "SEXO": SEXO_DICT,
+    "TIPO_PACIENTE": TIPO_PACIENTE_DICT,
+    "NACIONALIDAD": NACIONALIDAD_DICT,
+    "RESULTADO_LAB": RESULTADO_LAB_DICT,
+    "RESULTADO_ANTIGENO": RESULTADO_LAB_DICT,
+    "CLASIFICACION_FINAL": CLASIFICACION_FINAL_DICT,
+
+    # Yes or No fields.
+    "MIGRANTE": SI_NO_DICT,
+    "INTUBADO": SI_NO_DICT,
+    "NEUMONIA": SI_NO_DICT,
+    "EMBARAZO": SI_NO_DICT,
+    "HABLA_LENGUA_INDIG": SI_NO_DICT,
+    "INDIGENA": SI_NO_DICT,
+    "TOMA_MUESTRA_LAB": SI_NO_DICT,
+    "TOMA_MUESTRA_ANTIGENO": SI_NO_DICT,
+    "DIABETES": SI_NO_DICT,
+    "EPOC": SI_NO_DICT,
+    "ASMA": SI_NO_DICT,
+    "INMUSUPR": SI_NO_DICT,
+    "HIPERTENSION": SI_NO_DICT,
+    "OTRA_COM": SI_NO_DICT,
+    "CARDIOVASCULAR": SI_NO_DICT,
+    "OBESIDAD": SI_NO_DICT,
+    "RENAL_CRONICA": SI_NO_DICT,
+    "TABAQUISMO": SI_NO_DICT,
+    "OTRO_CASO": SI_NO_DICT,
+    "UCI": SI_NO_DICT
 }
 
 
@@ -46,15 +99,21 @@ def download():
 
     print("Downloading ZIP files...")
 
-    with requests.get(DATA_URL) as response:
+    # The responses are streamed so the ZIP files are never fully loaded in memory.
+    # We fail on error pages and let urllib3 undo any gzip or deflate Content-Encoding.
+    with requests.get(DATA_URL, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
 
         with open(DATA_FILE, "wb") as temp_file:
-            temp_file.write(response.content)
+            shutil.copyfileobj(response.raw, temp_file, CHUNK_SIZE)
 
-    with requests.get(CATALOG_URL) as response:
+    with requests.get(CATALOG_URL, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
 
         with open(CATALOG_FILE, "wb") as temp_file:
-            temp_file.write(response.content)
+            shutil.copyfileobj(response.raw, temp_file, CHUNK_SIZE)
 
     print("ZIP files downloaded.")
 
@@ -62,176 +121,360 @@ def download():
 def convert():
     """Extracts the data from the zip files and creates a new dataset with them."""
 
-    data_list = list()
+    # The catalog rarely changes, so we reuse the previous results when the file is the same.
+    catalog_hash = get_file_hash(CATALOG_FILE)
+
+    if load_catalog_cache(catalog_hash):
+        print("Catalog loaded from cache.")
+    else:
+        read_catalog()
+        save_catalog_cache(catalog_hash)
+        print("Catalog file processed.")
+
+    # Extract the CSV file from the ZIP file.
+    with zipfile.ZipFile(DATA_FILE) as data_zip:
+        print("Reading CSV file...")
+
+        with data_zip.open(data_zip.namelist()[0], "r") as csv_file, \
+                open("./mx_data.csv", "w", encoding="utf-8", newline="") as result_csv:
+            print("Procesing CSV file...")
+
+            # The catalog codes are read as integers and used as positions in dense lookup arrays.
+            lookups = {column: build_lookup(catalog)
+                       for column, catalog in CATALOG_COLUMNS.items()}
+
+            municipios_lookup = build_municipios_lookup()
+
+            dtypes = defaultdict(lambda: str, {column: np.int64 for column in [
+                                 *CATALOG_COLUMNS, "MUNICIPIO_RES"]})
+
+            # The CSV file is read in chunks, each one is written as soon as it is processed.
+            # This keeps memory usage constant while letting pandas map whole columns at once.
+            reader = pd.read_csv(csv_file, dtype=dtypes, encoding="latin-1",
+                                 keep_default_na=False, chunksize=CSV_CHUNK_ROWS)
+
+            for index, df in enumerate(reader):
+
+                # we start with the municipality one so it doesn't break the states column.
+                df["MUNICIPIO_RES"] = municipios_lookup[
+                    df["ENTIDAD_RES"].to_numpy() * 1000 + df["MUNICIPIO_RES"].to_numpy()]
+
+                for column, lookup in lookups.items():
+                    df[column] = translate_codes(
+                        column, lookup, df[column].to_numpy())
+
+                # Special case where a country is not defined.
+                df.loc[df["PAIS_ORIGEN"] == "99", "PAIS_ORIGEN"] = "NO ESPECIFICADO"
+
+                # Fix encoding issues, the column only has a few distinct countries so we fix each one once.
+                codes, countries = pd.factorize(df["PAIS_NACIONALIDAD"])
+                df["PAIS_NACIONALIDAD"] = np.array(
+                    [fix_encoding(country) for country in countries], dtype=object)[codes]
+
+                # The published files use the CRLF line endings of the csv module on every platform.
+                df.to_csv(result_csv, header=index == 0,
+                          index=False, lineterminator="\r\n")
+
+            print("CSV file processed.")
+            print("Dataset saved.")
+
+    # Clean up.
+    os.remove(DATA_FILE)
+    os.remove(CATALOG_FILE)
+
+
+def read_catalog():
+    """Reads the catalog workbook and fills the catalog dicts with its values."""
+
+    # Extract the workbook so it can be read from disk instead of from memory.
+    # The temporary folder is removed even if reading the workbook fails.
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        with zipfile.ZipFile(CATALOG_FILE) as catalog_zip:
+            print("Reading catalog file...")
 
-    with zipfile.ZipFile(CATALOG_FILE) as catalog_zip:
-        print("Reading catalog file...")
+            workbook_path = catalog_zip.extract(
+                catalog_zip.namelist()[1], path=temp_dir)
 
-        with catalog_zip.open(catalog_zip.namelist()[1]) as cat_file:
-            print("Processing catalog file...")
+        print("Processing catalog file...")
 
-            workbook = load_workbook(io.BytesIO(
-                cat_file.read()), read_only=True)
+        with CalamineWorkbook.from_path(workbook_path) as workbook:
 
             # Origen
-            sheet = workbook["Catálogo ORIGEN"]
+            sheet = workbook.get_sheet_by_name("Catálogo ORIGEN").to_python()
 
-            for row in sheet.rows:
-                ORIGEN_DICT[str(row[0].value)] = str(row[1].value).strip()
+            for row in sheet:
+                ORIGEN_DICT[get_cell_text(row[0])] = get_cell_text(row[1])
 
             # Sectores de Salud
-            sheet = workbook["Catálogo SECTOR"]
+            sheet = workbook.get_sheet_by_name("Catálogo SECTOR").to_python()
 
-            for row in sheet.rows:
-                SECTOR_DICT[str(row[0].value)] = str(row[1].value).strip()
+            for row in sheet:
+                SECTOR_DICT[get_cell_text(row[0])] = get_cell_text(row[1])
 
             # Sexo
-            sheet = workbook["Catálogo SEXO"]
+            sheet = workbook.get_sheet_by_name("Catálogo SEXO").to_python()
 
-            for row in sheet.rows:
-                SEXO_DICT[str(row[0].value)] = str(row[1].value).strip()
+            for row in sheet:
+                SEXO_DICT[get_cell_text(row[0])] = get_cell_text(row[1])
 
             # Tipo Paciente
-            sheet = workbook["Catálogo TIPO_PACIENTE"]
+            sheet = workbook.get_sheet_by_name("Catálogo TIPO_PACIENTE").to_python()
 
-            for row in sheet.rows:
-                TIPO_PACIENTE_DICT[str(row[0].value)] = str(
-                    row[1].value).strip()
+            for row in sheet:
+                TIPO_PACIENTE_DICT[get_cell_text(row[0])] = get_cell_text(row[1])
 
             # Si / No
-            sheet = workbook["Catálogo SI_NO"]
+            sheet = workbook.get_sheet_by_name("Catálogo SI_NO").to_python()
 
-            for row in sheet.rows:
-                SI_NO_DICT[str(row[0].value)] = str(row[1].value).strip()
+            for row in sheet:
+                SI_NO_DICT[get_cell_text(row[0])] = get_cell_text(row[1])
 
             # Nacionalidad
-            sheet = workbook["Catálogo NACIONALIDAD"]
+            sheet = workbook.get_sheet_by_name("Catálogo NACIONALIDAD").to_python()
 
-            for row in sheet.rows:
-                NACIONALIDAD_DICT[str(row[0].value)] = str(
-                    row[1].value).strip()
+            for row in sheet:
+                NACIONALIDAD_DICT[get_cell_text(row[0])] = get_cell_text(row[1])
 
             # Resultado Lab
-            sheet = workbook["Catálogo RESULTADO_LAB"]
+            sheet = workbook.get_sheet_by_name("Catálogo RESULTADO_LAB").to_python()
 
-            for row in sheet.rows:
+            for row in sheet:
 
-                # This one has an issue with rows that are not empty.
-                if len(row) > 0:
-                    RESULTADO_LAB_DICT[str(row[0].value)] = str(
-                        row[1].value).strip()
+                # This one has an issue with rows that are empty.
+                if row[0] != "":
+                    RESULTADO_LAB_DICT[get_cell_text(row[0])] = get_cell_text(row[1])
 
             # Clasificación Final
-            sheet = workbook["Catálogo CLASIFICACION_FINAL"]
+            sheet = workbook.get_sheet_by_name(
+                "Catálogo CLASIFICACION_FINAL").to_python()
 
-            for row in sheet.rows:
-
-                # Skip None row.
-                if row[0].value:
-
-                    row_value = row[1].value
-
-                    # Fix encoding issues.
-                    for k, v in FIXERS.items():
-                        row_value = row_value.replace(k, v).strip()
-
-                    CLASIFICACION_FINAL_DICT[str(row[0].value)] = row_value
+            for row in sheet:
 
+                # Skip empty rows.
+                if row[0] != "":
+                    CLASIFICACION_FINAL_DICT[get_cell_text(row[0])] = fix_encoding(
+                        row[1])
 
             # Entidades Federativas
-            sheet = workbook["Catálogo de ENTIDADES"]
+            sheet = workbook.get_sheet_by_name("Catálogo de ENTIDADES").to_python()
 
-            for row in sheet.rows:
-                ENTIDADES_DICT[str(row[0].value)] = str(row[1].value).strip()
+            for row in sheet:
+                ENTIDADES_DICT[get_cell_text(row[0])] = get_cell_text(row[1])
 
             # Municipios
-            sheet = workbook["Catálogo MUNICIPIOS"]
+            sheet = workbook.get_sheet_by_name("Catálogo MUNICIPIOS").to_python()
 
-            for row in sheet.rows:
+            for row in sheet:
                 # This one requires to combine the state and municipality codes.
                 state_with_municipality = "{}-{}".format(
-                    row[0].value, row[2].value)
+                    get_cell_text(row[0]), get_cell_text(row[2]))
 
-                MUNICIPIOS_DICT[state_with_municipality] = str(
-                    row[1].value).strip()
+                MUNICIPIOS_DICT[state_with_municipality] = get_cell_text(row[1])
 
-            print("Catalog file processed.")
 
-    # Extract the CSV file from the ZIP file.
-    with zipfile.ZipFile(DATA_FILE) as data_zip:
-        print("Reading CSV file...")
+def build_lookup(catalog):
+    """Builds a dense lookup array where each catalog value is stored at the position of its code.
 
-        with data_zip.open(data_zip.namelist()[0], "r") as csv_file:
-            print("Procesing CSV file...")
+    Parameters
+    ----------
+    catalog : dict
+        One of the catalog dicts.
 
-            reader = csv.DictReader(
-                io.TextIOWrapper(csv_file, encoding="latin-1"))
+    Returns
+    -------
+    numpy.ndarray
+        An object array indexed by the numeric catalog codes, unknown codes are None.
 
-            for row in reader:
+    """
 
-                # we start with the municipality one so it doesn't break the states column.
-                state_with_municipality = "{}-{}".format(
-                    row["MUNICIPIO_RES"], row["ENTIDAD_RES"])
-
-                row["MUNICIPIO_RES"] = MUNICIPIOS_DICT.get(
-                    state_with_municipality, "NO ETIQUETADO")
-
-                row["ENTIDAD_UM"] = ENTIDADES_DICT[row["ENTIDAD_UM"]]
-                row["ENTIDAD_NAC"] = ENTIDADES_DICT[row["ENTIDAD_NAC"]]
-                row["ENTIDAD_RES"] = ENTIDADES_DICT[row["ENTIDAD_RES"]]
-                row["ORIGEN"] = ORIGEN_DICT[row["ORIGEN"]]
-                row["SECTOR"] = SECTOR_DICT[row["SECTOR"]]
-                row["SEXO"] = SEXO_DICT[row["SEXO"]]
-                row["TIPO_PACIENTE"] = TIPO_PACIENTE_DICT[row["TIPO_PACIENTE"]]
-                row["NACIONALIDAD"] = NACIONALIDAD_DICT[row["NACIONALIDAD"]]
-                row["RESULTADO_LAB"] = RESULTADO_LAB_DICT[row["RESULTADO_LAB"]]
-                row["RESULTADO_ANTIGENO"] = RESULTADO_LAB_DICT[row["RESULTADO_ANTIGENO"]]
-                row["CLASIFICACION_FINAL"] = CLASIFICACION_FINAL_DICT[row["CLASIFICACION_FINAL"]]
-
-                # Yes or No fields.
-                row["MIGRANTE"] = SI_NO_DICT[row["MIGRANTE"]]
-                row["INTUBADO"] = SI_NO_DICT[row["INTUBADO"]]
-                row["NEUMONIA"] = SI_NO_DICT[row["NEUMONIA"]]
-                row["EMBARAZO"] = SI_NO_DICT[row["EMBARAZO"]]
-                row["HABLA_LENGUA_INDIG"] = SI_NO_DICT[row["HABLA_LENGUA_INDIG"]]
-                row["INDIGENA"] = SI_NO_DICT[row["INDIGENA"]]
-                row["TOMA_MUESTRA_LAB"] = SI_NO_DICT[row["TOMA_MUESTRA_LAB"]]
-                row["TOMA_MUESTRA_ANTIGENO"] = SI_NO_DICT[row["TOMA_MUESTRA_ANTIGENO"]]
-                row["DIABETES"] = SI_NO_DICT[row["DIABETES"]]
-                row["EPOC"] = SI_NO_DICT[row["EPOC"]]
-                row["ASMA"] = SI_NO_DICT[row["ASMA"]]
-                row["INMUSUPR"] = SI_NO_DICT[row["INMUSUPR"]]
-                row["HIPERTENSION"] = SI_NO_DICT[row["HIPERTENSION"]]
-                row["OTRA_COM"] = SI_NO_DICT[row["OTRA_COM"]]
-                row["CARDIOVASCULAR"] = SI_NO_DICT[row["CARDIOVASCULAR"]]
-                row["OBESIDAD"] = SI_NO_DICT[row["OBESIDAD"]]
-                row["RENAL_CRONICA"] = SI_NO_DICT[row["RENAL_CRONICA"]]
-                row["TABAQUISMO"] = SI_NO_DICT[row["TABAQUISMO"]]
-                row["OTRO_CASO"] = SI_NO_DICT[row["OTRO_CASO"]]
-                row["UCI"] = SI_NO_DICT[row["UCI"]]
+    # Skip the header row and any other non numeric code.
+    codes = {int(k): v for k, v in catalog.items() if k.isdigit()}
 
-                # Special case where a country is not defined.
-                if str(row["PAIS_ORIGEN"]) == "99":
-                    row["PAIS_ORIGEN"] = "NO ESPECIFICADO"
+    lookup = np.full(max(codes) + 1, None, dtype=object)
 
-                # Fix encoding issues.
-                for k, v in FIXERS.items():
-                    row["PAIS_NACIONALIDAD"] = row["PAIS_NACIONALIDAD"].replace(
-                        k, v).strip()
+    for code, value in codes.items():
+        lookup[code] = value
 
-                data_list.append(row)
+    return lookup
 
-            print("CSV file processed.")
 
-    with open("./mx_data.csv", "w", encoding="utf-8", newline="") as result_csv:
-        writer = csv.DictWriter(result_csv, reader.fieldnames)
-        writer.writeheader()
-        writer.writerows(data_list)
-        print("Dataset saved.")
+def translate_codes(column, lookup, codes):
+    """Translates the numeric codes of a column using its dense lookup array.
 
-    # Clean up.
-    os.remove(DATA_FILE)
-    os.remove(CATALOG_FILE)
+    Parameters
+    ----------
+    column : str
+        The name of the column, used in the error message.
+
+    lookup : numpy.ndarray
+        The lookup array created by build_lookup().
+
+    codes : numpy.ndarray
+        The numeric codes of the column.
+
+    Returns
+    -------
+    numpy.ndarray
+        An object array with the catalog values.
+
+    Raises
+    ------
+    KeyError
+        If any code is not in the catalog.
+
+    """
+
+    # Codes outside the array are looked up at position 0 and flagged as unknown.
+    in_range = (codes >= 0) & (codes < len(lookup))
+    values = lookup[np.where(in_range, codes, 0)]
+
+    # Codes inside the array that are missing from the catalog are stored as None.
+    is_unknown = ~in_range | pd.isna(values)
+
+    if is_unknown.any():
+        raise KeyError("{} has codes that are not in the catalog: {}".format(
+            column, ", ".join(str(code) for code in np.unique(codes[is_unknown]))))
+
+    return values
+
+
+def build_municipios_lookup():
+    """Builds a dense lookup array for the municipalities catalog.
+
+    Municipality codes are only unique within a state, so each value is stored
+    at the position state * 1000 + municipality.
+
+    Returns
+    -------
+    numpy.ndarray
+        An object array with the municipality names, unknown codes are 'NO ETIQUETADO'.
+
+    """
+
+    lookup = np.full(100_000, "NO ETIQUETADO", dtype=object)
+
+    for k, v in MUNICIPIOS_DICT.items():
+        municipality, state = k.split("-")
+
+        # Skip the header row.
+        if municipality.isdigit() and state.isdigit():
+            lookup[int(state) * 1000 + int(municipality)] = v
+
+    return lookup
+
+
+def get_cell_text(value):
+    """Converts a workbook cell value into text.
+
+    Parameters
+    ----------
+    value : str or float
+        The cell value. Numeric cells are read as floats.
+
+    Returns
+    -------
+    str
+        The stripped text, whole numbers don't include decimals.
+
+    """
+
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+
+    return str(value).strip()
+
+
+def get_file_hash(file_path):
+    """Gets the MD5 hash of the specified file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest of the file contents.
+
+    """
+
+    file_hash = hashlib.md5()
+
+    with open(file_path, "rb") as temp_file:
+
+        for chunk in iter(lambda: temp_file.read(CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def load_catalog_cache(catalog_hash):
+    """Fills the catalog dicts from the cache file if it belongs to the same catalog.
+
+    Parameters
+    ----------
+    catalog_hash : str
+        The hash of the current catalog ZIP file.
+
+    Returns
+    -------
+    bool
+        True if the catalog dicts were filled, False otherwise.
+
+    """
+
+    if not os.path.exists(CATALOG_CACHE_FILE):
+        return False
+
+    with open(CATALOG_CACHE_FILE, "r", encoding="utf-8") as cache_file:
+        cache = json.load(cache_file)
+
+    if cache["hash"] != catalog_hash:
+        return False
+
+    for name, catalog in CATALOGS.items():
+        catalog.clear()
+        catalog.update(cache["catalogs"][name])
+
+    return True
+
+
+def save_catalog_cache(catalog_hash):
+    """Saves the catalog dicts into the cache file.
+
+    Parameters
+    ----------
+    catalog_hash : str
+        The hash of the current catalog ZIP file.
+
+    """
+
+    with open(CATALOG_CACHE_FILE, "w", encoding="utf-8") as cache_file:
+        json.dump({"hash": catalog_hash, "catalogs": CATALOGS},
+                  cache_file, ensure_ascii=False)
+
+
+def fix_encoding(value):
+    """Fixes text that was encoded as UTF-8 but decoded as latin-1.
+
+    Parameters
+    ----------
+    value : str
+        The text to fix.
+
+    Returns
+    -------
+    str
+        The fixed and stripped text. Text that was not wrongly decoded is returned as is.
+
+    """
+
+    try:
+        return value.encode("latin-1").decode("utf-8").strip()
+    except UnicodeError:
+        return value.strip()
 
 
 if __name__ == "__main__":
@@ -2,30 +2,50 @@
 Generates various plots and insights from the global dataset.
 """
 
+import json
+import os
+
 import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 import numpy as np
 import pandas as pd
-import seaborn as sns
-
-
-sns.set(style="ticks",
-        rc={
-            "figure.figsize": [15, 10],
-            "text.color": "white",
-            "legend.fontsize": "large",
-            "xtick.labelsize": "x-large",
-            "ytick.labelsize": "x-large",
-            "axes.labelsize": "x-large",
-            "axes.titlesize": "x-large",
-            "axes.labelcolor": "white",
-            "axes.edgecolor": "white",
-            "xtick.color": "white",
-            "ytick.color": "white",
-            "axes.facecolor": "#111111",
-            "figure.facecolor": "#232b2b"}
-        )
+
+
+# The dark theme is applied on top of a ticks style with larger fonts and thicker axes.
+plt.rcParams.update({
+    "font.family": "sans-serif",
+    "font.sans-serif": ["Arial", "DejaVu Sans", "Liberation Sans", "Bitstream Vera Sans", "sans-serif"],
+    "font.size": 12,
+    "axes.linewidth": 1.25,
+    "axes.axisbelow": True,
+    "grid.color": ".8",
+    "grid.linewidth": 1,
+    "lines.solid_capstyle": "round",
+    "xtick.major.size": 6,
+    "xtick.major.width": 1.25,
+    "xtick.minor.size": 4,
+    "xtick.minor.width": 1,
+    "ytick.major.size": 6,
+    "ytick.major.width": 1.25,
+    "ytick.minor.size": 4,
+    "ytick.minor.width": 1,
+    "figure.figsize": [15, 10],
+    "text.color": "white",
+    "legend.fontsize": "large",
+    "xtick.labelsize": "x-large",
+    "ytick.labelsize": "x-large",
+    "axes.labelsize": "x-large",
+    "axes.titlesize": "x-large",
+    "axes.labelcolor": "white",
+    "axes.edgecolor": "white",
+    "xtick.color": "white",
+    "ytick.color": "white",
+    "axes.facecolor": "#111111",
+    "figure.facecolor": "#232b2b",
+    "path.simplify": True,
+    "path.simplify_threshold": 1.0,
+    "agg.path.chunksize": 10000})
 
 
 COUNTRIES = [
@@ -36,6 +56,25 @@ COUNTRIES = [
     ["United Kingdom", "United Kingdom", "lime"]
 ]
 
+# The daily totals of the DataFrames we have already resampled, keyed by their id.
+DAILY_TOTALS_CACHE = dict()
+
+# The maximum number of points drawn for each line, roughly the width of a figure in pixels.
+MAX_PLOT_POINTS = 1500
+
+
+# The CSV file is converted to Parquet once, later runs load the typed columns directly.
+CSV_FILE = "global_data.csv"
+PARQUET_FILE = "global_data.parquet"
+
+# The options used to parse the CSV file, the pyarrow engine parses it using multiple threads.
+# They are saved with the Parquet copy, so changing them also rebuilds it.
+CSV_OPTIONS = {
+    "parse_dates": ["isodate"],
+    "index_col": 0,
+    "engine": "pyarrow"
+}
+
 
 def get_top_10(df):
     """Gets the top 10 countries in each field.
@@ -47,20 +86,20 @@ def get_top_10(df):
 
     """
 
-    grouped_df = df.groupby("country").max()
+    # We only aggregate the 3 fields we are interested in.
+    grouped_df = df.groupby("country", sort=False)[
+        ["confirmed", "deaths", "recovered"]].max()
 
     # Confirmed cases
-    print(grouped_df.sort_values("confirmed",
-                                 ascending=False)["confirmed"][:10])
+    print(grouped_df["confirmed"].nlargest(10))
 
     # Deaths
-    print(grouped_df.sort_values("deaths", ascending=False)["deaths"][:10])
+    print(grouped_df["deaths"].nlargest(10))
 
     # Recoveries
-    print(grouped_df.sort_values("recovered",
-                                 ascending=False)["recovered"][:10])
+    print(grouped_df["recovered"].nlargest(10))
 
-    a = grouped_df.sort_values("recovered", ascending=False)["recovered"][:10]
+    a = grouped_df["recovered"].nlargest(10)
     print(a.to_markdown())
 
 
@@ -77,23 +116,8 @@ def get_global_counts_growths(df, field):
 
     """
 
-    # Resample the DataFrame by 1 day intervals.
-    resampled_df = df.resample("D").sum()
-
-    # We add 2 new columns to know the daily totals and their percent change.
-    resampled_df["difference"] = resampled_df[field].diff()
-    resampled_df["change"] = resampled_df["difference"].pct_change()
-
-    # We drop all NaN values.
-    resampled_df.dropna(inplace=True)
-
-    # We format the previous 2 columns so they can be easier to read.
-    resampled_df["difference"] = resampled_df["difference"].apply(int)
-
-    resampled_df["change"] = resampled_df["change"].apply(
-        lambda x: str(np.round(x * 100, 2)) + "%")
-
-    print(resampled_df[[field, "difference", "change"]][-10:])
+    # Resample the field by 1 day intervals.
+    print_growths(df[field].resample("D").sum())
 
 
 def get_country_counts_growths(df, country, field):
@@ -112,23 +136,32 @@ def get_country_counts_growths(df, country, field):
 
     """
 
-    # Filter our DataFrame so it only reads data from the country we are interested in.
-    filtered_df = df[df["country"] == country].copy()
+    # Filter our field so it only reads data from the country we are interested in.
+    print_growths(df.loc[df["country"] == country, field])
+
+
+def print_growths(series):
+    """Prints the last 10 daily totals and their percent change of a cumulative series.
 
-    # We add 2 new columns to know the daily totals and their percent change.
-    filtered_df["difference"] = filtered_df[field].diff()
-    filtered_df["change"] = filtered_df["difference"].pct_change()
+    Parameters
+    ----------
+    series : pandas.Series
+        A Series of cumulative counts indexed by date.
+
+    """
 
-    # We drop all NaN values.
-    filtered_df.dropna(inplace=True)
+    # We compute the daily totals and their percent change directly on the NumPy array.
+    values = series.to_numpy()
+    differences = np.diff(values)
 
-    # We format the previous 2 columns so they can be easier to read.
-    filtered_df["difference"] = filtered_df["difference"].apply(int)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes = differences[1:] / differences[:-1] - 1
 
-    filtered_df["change"] = filtered_df["change"].apply(
-        lambda x: str(np.round(x * 100, 2)) + "%")
+    # The first 2 days don't have a previous total to compare with.
+    growths_df = pd.DataFrame({series.name: values[2:], "difference": differences[1:].astype(np.int64),
+                               "change": changes}, index=series.index[2:])
 
-    print(filtered_df[[field, "difference", "change"]][-10:])
+    print(growths_df[-10:].to_string(formatters={"change": "{:.2%}".format}))
 
 
 def get_100_to_3200(df):
@@ -144,38 +177,115 @@ def get_100_to_3200(df):
     # We remove all rows lower than 100.
     df = df[df["confirmed"] >= 100]
 
-    # We define our bins and their labels.
-    bins = [(100, 199), (200, 399), (400, 799), (800, 1599), (1600, 3200)]
+    # Only process countries if their confirmed cases are equal or greater than 3,200.
+    df = df[df.groupby("country", sort=False)["confirmed"].transform(
+        "max") >= 3200]
+
+    # We define our bins and their labels. The bins include their left edge, so [100, 200) means 100-199.
+    bins = [100, 200, 400, 800, 1600, 3201]
     labels = ["100-199", "200-399", "400-799", "800-1599", "1600-3200"]
 
-    # We extract all the available countries in the dataset.
-    all_countries = sorted(df["country"].unique().tolist())
+    # We assign each day to its bin and count how many days each country has in each one.
+    days_bins = pd.cut(df["confirmed"], bins=bins, right=False, labels=labels)
 
-    # These lists will be filled with values in the next step.
-    valid_countries = list()
-    data_list = list()
+    # We create a final DataFrame with the results and a new column with the total days from 100 to 3,200.
+    final_df = df.groupby(["country", days_bins], observed=False).size(
+    ).unstack(fill_value=0)
 
-    # We iterate over all the countries we have and create temporary DataFrames with them.
-    for country in all_countries:
+    final_df.index.name = None
+    final_df.columns.name = None
+    final_df["total"] = final_df.sum(axis=1)
+    print(final_df)
 
-        temp_df = df[df["country"] == country]
 
-        # Only process countries if their confirmed cases are equal or greater than 3,200.
-        if temp_df["confirmed"].max() >= 3200:
-            temp_list = list()
+def downsample(x, y, threshold=MAX_PLOT_POINTS):
+    """Reduces a series to the specified number of points using the
+    Largest-Triangle-Three-Buckets algorithm, which keeps the visual shape of the line.
 
-            # We iterate over our bins and count how many days each one has.
-            for item in bins:
-                temp_list.append(temp_df[(temp_df["confirmed"] >= item[0]) & (
-                    temp_df["confirmed"] <= item[1])]["confirmed"].count())
+    Parameters
+    ----------
+    x : array-like
+        The x values, they are assumed to be evenly spaced.
 
-            data_list.append(temp_list)
-            valid_countries.append(country)
+    y : array-like
+        The y values.
 
-    # We create a final DataFrame with the results and a new column with the total days from 100 to 3,200.
-    final_df = pd.DataFrame(data_list, index=valid_countries, columns=labels)
-    final_df["total"] = final_df.sum(axis=1)
-    print(final_df)
+    threshold : int
+        The maximum number of points to keep.
+
+    Returns
+    -------
+    tup
+        A tuple with the selected x and y values. Series that are already short enough are returned as is.
+
+    """
+
+    if len(y) <= threshold:
+        return x, y
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    # NaN values (such as the first difference) are treated as zeros for the triangle areas.
+    values = np.nan_to_num(y.astype(np.float64))
+    positions = np.arange(len(y))
+
+    # The first and last points are always kept, the rest are split into equal buckets.
+    edges = np.linspace(1, len(y) - 1, threshold - 1).astype(np.intp)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = len(y) - 1
+
+    previous = 0
+
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else len(y)
+
+        # The third vertex of the triangle is the average of the next bucket.
+        average_x = positions[end:next_end].mean()
+        average_y = values[end:next_end].mean()
+
+        # We keep the point that forms the largest triangle with the previously selected one.
+        areas = np.abs((positions[previous] - average_x) * (values[start:end] - values[previous]) -
+                       (positions[previous] - positions[start:end]) * (average_y - values[previous]))
+
+        previous = start + np.argmax(areas)
+        selected[i + 1] = previous
+
+    return x[selected], y[selected]
+
+
+def get_daily_totals(df):
+    """Gets the daily totals for all countries combined, only rows with confirmed cases are counted.
+
+    The results are cached, so plotting the same DataFrame again doesn't resample it again.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        A DataFrame containing the global data.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A DataFrame with the daily confirmed cases, deaths and recoveries. It must not be modified.
+
+    """
+
+    if id(df) not in DAILY_TOTALS_CACHE:
+
+        # Filter out rows with zero confirmed cases.
+        filtered_df = df[df["confirmed"] > 0]
+
+        # Resample the data by 1 day intervals and sum the daily totals.
+        resampled_df = filtered_df[["confirmed", "deaths", "recovered"]].resample(
+            "D").sum()
+
+        # We also keep the original DataFrame so its id can't be reused while cached.
+        DAILY_TOTALS_CACHE[id(df)] = (df, resampled_df)
+
+    return DAILY_TOTALS_CACHE[id(df)][1]
 
 
 def plot_global_daily_growth(df):
@@ -188,23 +298,20 @@ def plot_global_daily_growth(df):
 
     """
 
-    # Filter out rows with zero confirmed cases.
-    df = df[df["confirmed"] > 0]
-
-    # Resample the data by 1 day intervals and sum the daily totals.
-    resampled_df = df.resample("D").sum()
+    # Get the daily totals of the rows with confirmed cases.
+    resampled_df = get_daily_totals(df)
 
     # Create 3 line plots on the same axis, one for each field.
     fig, ax = plt.subplots()
 
-    ax.plot(resampled_df.index,
-            resampled_df["confirmed"], label="Confirmed", color="gold")
+    ax.plot(*downsample(resampled_df.index, resampled_df["confirmed"]),
+            label="Confirmed", color="gold", rasterized=True)
 
-    ax.plot(resampled_df.index,
-            resampled_df["deaths"], label="Deaths", color="lightblue")
+    ax.plot(*downsample(resampled_df.index, resampled_df["deaths"]),
+            label="Deaths", color="lightblue", rasterized=True)
 
-    ax.plot(resampled_df.index,
-            resampled_df["recovered"], label="Recoveries", color="lime")
+    ax.plot(*downsample(resampled_df.index, resampled_df["recovered"]),
+            label="Recoveries", color="lime", rasterized=True)
 
     # Customize tickers.
     ax.xaxis.set_major_locator(mdates.DayLocator(interval=7))
@@ -241,9 +348,12 @@ def plot_country_daily_growth(df, country):
     # Create 3 line plots on the same axis, one for each field.
     fig, ax = plt.subplots()
 
-    ax.plot(df.index, df["confirmed"], label="Confirmed", color="gold")
-    ax.plot(df.index, df["deaths"], label="Deaths", color="lightblue")
-    ax.plot(df.index, df["recovered"], label="Recoveries", color="lime")
+    ax.plot(*downsample(df.index, df["confirmed"]),
+            label="Confirmed", color="gold", rasterized=True)
+    ax.plot(*downsample(df.index, df["deaths"]),
+            label="Deaths", color="lightblue", rasterized=True)
+    ax.plot(*downsample(df.index, df["recovered"]),
+            label="Recoveries", color="lime", rasterized=True)
 
     # Customize tickers.
     ax.xaxis.set_major_locator(mdates.DayLocator(interval=7))
@@ -270,28 +380,21 @@ def plot_global_daily_counts(df):
 
     """
 
-    # Filter out rows with zero confirmed cases.
-    df = df[df["confirmed"] > 0]
-
-    # Resample the data by 1 day intervals and sum the daily totals.
-    resampled_df = df.resample("D").sum()
-
-    # Add 3 new columns, one for each field counts.
-    resampled_df["confirmed_difference"] = resampled_df["confirmed"].diff()
-    resampled_df["deaths_difference"] = resampled_df["deaths"].diff()
-    resampled_df["recovered_difference"] = resampled_df["recovered"].diff()
+    # Get the daily totals of the rows with confirmed cases. The cached
+    # DataFrame is shared, so the differences are stored in a new one.
+    resampled_df = get_daily_totals(df).diff().add_suffix("_difference")
 
     # Create 3 line plots on the same axis, one for each field counts.
     fig, ax = plt.subplots()
 
-    ax.plot(resampled_df.index,
-            resampled_df["confirmed_difference"], label="Confirmed", color="gold")
+    ax.plot(*downsample(resampled_df.index, resampled_df["confirmed_difference"]),
+            label="Confirmed", color="gold", rasterized=True)
 
-    ax.plot(resampled_df.index,
-            resampled_df["deaths_difference"], label="Deaths", color="lightblue")
+    ax.plot(*downsample(resampled_df.index, resampled_df["deaths_difference"]),
+            label="Deaths", color="lightblue", rasterized=True)
 
-    ax.plot(resampled_df.index,
-            resampled_df["recovered_difference"], label="Recoveries", color="lime")
+    ax.plot(*downsample(resampled_df.index, resampled_df["recovered_difference"]),
+            label="Recoveries", color="lime", rasterized=True)
 
     # Customize tickers.
     ax.xaxis.set_major_locator(mdates.DayLocator(interval=7))
@@ -323,22 +426,22 @@ def plot_country_daily_counts(df, country):
 
     # Filter out rows with zero confirmed cases and only select rows that belong
     # to the specified country.
-    df = df[(df["confirmed"] > 0) & (df["country"] == country)].copy()
+    df = df[(df["confirmed"] > 0) & (df["country"] == country)]
 
-    # Add 3 new columns, one for each field counts.
-    df["confirmed_difference"] = df["confirmed"].diff()
-    df["deaths_difference"] = df["deaths"].diff()
-    df["recovered_difference"] = df["recovered"].diff()
+    # Calculate the daily counts of each field.
+    confirmed_difference = df["confirmed"].diff()
+    deaths_difference = df["deaths"].diff()
+    recovered_difference = df["recovered"].diff()
 
     # Create 3 line plots on the same axis, one for each field counts.
     fig, ax = plt.subplots()
 
-    ax.plot(df.index, df["confirmed_difference"],
-            label="Confirmed", color="gold")
-    ax.plot(df.index, df["deaths_difference"],
-            label="Deaths", color="lightblue")
-    ax.plot(df.index, df["recovered_difference"],
-            label="Recoveries", color="lime")
+    ax.plot(*downsample(df.index, confirmed_difference),
+            label="Confirmed", color="gold", rasterized=True)
+    ax.plot(*downsample(df.index, deaths_difference),
+            label="Deaths", color="lightblue", rasterized=True)
+    ax.plot(*downsample(df.index, recovered_difference),
+            label="Recoveries", color="lime", rasterized=True)
 
     # Customize tickers.
     ax.xaxis.set_major_locator(mdates.DayLocator(interval=7))
@@ -368,18 +471,21 @@ def plot_daily_comparison(df, field):
 
     """
 
-    # Filter out rows with zero confirmed cases.
-    df = df[df[field] > 0]
+    # Filter out rows with zero confirmed cases and only keep the countries we will plot.
+    df = df[(df[field] > 0) & (df["country"].isin(
+        [country[0] for country in COUNTRIES]))]
+
+    # Calculate the daily differences of all the countries at once.
+    differences = df.groupby("country", sort=False)[field].diff()
 
     # Create a line plot for each country and add it to the same axis.
     fig, ax = plt.subplots()
 
     for country in COUNTRIES:
-        temp_df = df[df["country"] == country[0]].copy()
-        temp_df["difference"] = temp_df[field].diff()
+        temp_differences = differences[(df["country"] == country[0]).to_numpy()]
 
-        ax.plot(temp_df.index, temp_df["difference"],
-                label=country[1], color=country[2])
+        ax.plot(*downsample(temp_differences.index, temp_differences),
+                label=country[1], color=country[2], rasterized=True)
 
     # Ticker customizations.
     ax.xaxis.set_major_locator(mdates.DayLocator(interval=7))
@@ -396,10 +502,41 @@ def plot_daily_comparison(df, field):
     plt.savefig("daily_comparison.png", facecolor="#232b2b")
 
 
+def load_data():
+    """Loads the global dataset, using its Parquet copy when it is up to date.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A DataFrame containing the global data.
+
+    """
+
+    # The Parquet copy is only used when it was made from this exact CSV file and with the same options.
+    # Extracted files can keep an old timestamp, so we compare the size and mtime for equality.
+    csv_stat = os.stat(CSV_FILE)
+    csv_options = json.dumps(CSV_OPTIONS, sort_keys=True)
+    csv_version = [csv_stat.st_size, csv_stat.st_mtime_ns]
+
+    if os.path.exists(PARQUET_FILE):
+        df = pd.read_parquet(PARQUET_FILE)
+
+        if df.attrs.get("csv_options") == csv_options and df.attrs.get("csv_version") == csv_version:
+            return df
+
+    df = pd.read_csv(CSV_FILE, **CSV_OPTIONS)
+
+    # The options and the file version are stored in the Parquet metadata along with the data.
+    df.attrs["csv_options"] = csv_options
+    df.attrs["csv_version"] = csv_version
+    df.to_parquet(PARQUET_FILE)
+
+    return df
+
+
 if __name__ == "__main__":
 
-    main_df = pd.read_csv("global_data.csv", parse_dates=[
-                          "isodate"], index_col=0)
+    main_df = load_data()
 
     # get_top_10(main_df)
     # get_global_counts_growths(main_df, "deaths")
@@ -2,30 +2,134 @@
 Generates various plots and insights from the Mexican dataset.
 """
 
+import functools
+import hashlib
+import inspect
+import json
+import os
+
 import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 import numpy as np
 import pandas as pd
-import seaborn as sns
-
-
-sns.set(style="ticks",
-        rc={
-            "figure.figsize": [15, 10],
-            "text.color": "white",
-            "legend.fontsize": "large",
-            "xtick.labelsize": "x-large",
-            "ytick.labelsize": "x-large",
-            "axes.labelsize": "x-large",
-            "axes.titlesize": "x-large",
-            "axes.labelcolor": "white",
-            "axes.edgecolor": "white",
-            "xtick.color": "white",
-            "ytick.color": "white",
-            "axes.facecolor": "#111111",
-            "figure.facecolor": "#232b2b"}
-        )
+
+
+# The dark theme is applied on top of a ticks style with larger fonts and thicker axes.
+plt.rcParams.update({
+    "font.family": "sans-serif",
+    "font.sans-serif": ["Arial", "DejaVu Sans", "Liberation Sans", "Bitstream Vera Sans", "sans-serif"],
+    "font.size": 12,
+    "axes.linewidth": 1.25,
+    "axes.axisbelow": True,
+    "grid.color": ".8",
+    "grid.linewidth": 1,
+    "lines.solid_capstyle": "round",
+    "xtick.major.size": 6,
+    "xtick.major.width": 1.25,
+    "xtick.minor.size": 4,
+    "xtick.minor.width": 1,
+    "ytick.major.size": 6,
+    "ytick.major.width": 1.25,
+    "ytick.minor.size": 4,
+    "ytick.minor.width": 1,
+    "figure.figsize": [15, 10],
+    "text.color": "white",
+    "legend.fontsize": "large",
+    "xtick.labelsize": "x-large",
+    "ytick.labelsize": "x-large",
+    "axes.labelsize": "x-large",
+    "axes.titlesize": "x-large",
+    "axes.labelcolor": "white",
+    "axes.edgecolor": "white",
+    "xtick.color": "white",
+    "ytick.color": "white",
+    "axes.facecolor": "#111111",
+    "figure.facecolor": "#232b2b",
+    "path.simplify": True,
+    "path.simplify_threshold": 1.0,
+    "agg.path.chunksize": 10000})
+
+
+# The CSV file is converted to Parquet once, later runs load the typed columns directly.
+CSV_FILE = "mx_data.csv"
+PARQUET_FILE = "mx_data.parquet"
+
+# The laboratory result column and the values used by our insights.
+RESULT_COLUMN = "RESULTADO_LAB"
+POSITIVE_RESULT = "POSITIVO A SARS-COV-2"
+NOT_POSITIVE_RESULT = "NO POSITIVO A SARS-COV-2"
+PENDING_RESULT = "RESULTADO PENDIENTE"
+
+# The options used to parse the CSV file, they are saved with the Parquet copy so changing them also rebuilds it.
+# We only read the columns used by our insights and plots.
+# Dates are parsed while reading, a missing date of death is stored as 9999-99-99.
+# Columns with few distinct values are loaded as categories and ages fit in a single byte.
+# The pyarrow engine parses the CSV file using multiple threads.
+CSV_OPTIONS = {
+    "usecols": ["ENTIDAD_RES", "SEXO", "EDAD", RESULT_COLUMN,
+                "FECHA_INGRESO", "FECHA_SINTOMAS", "FECHA_DEF"],
+    "parse_dates": ["FECHA_INGRESO", "FECHA_SINTOMAS", "FECHA_DEF"],
+    "na_values": ["9999-99-99"],
+    "dtype": {RESULT_COLUMN: "category", "SEXO": "category",
+              "ENTIDAD_RES": "category", "EDAD": "uint8"},
+    "engine": "pyarrow"
+}
+
+
+def cached_plot(outfile, columns):
+    """Skips a plot function when its image was already generated from the same data and code.
+
+    Parameters
+    ----------
+    outfile : str
+        The image file saved by the plot function.
+
+    columns : list
+        The columns the plot function reads from the DataFrame.
+
+    Returns
+    -------
+    function
+        A decorator for plot functions that take the Mexican DataFrame.
+
+    """
+
+    def decorator(plot_function):
+
+        # The source of this module holds the plot code, its helpers and the plot settings.
+        # Any edit to it invalidates the cached images.
+        with open(inspect.getsourcefile(plot_function), "rb") as source_file:
+            source_hash = hashlib.sha256(source_file.read()).hexdigest()
+
+        @functools.wraps(plot_function)
+        def wrapper(df):
+
+            # We hash only the columns used by the plot along with the source and store it next to the image.
+            data_hash = hashlib.sha256(pd.util.hash_pandas_object(
+                df[columns], index=False).to_numpy().tobytes())
+
+            data_hash.update(source_hash.encode("utf-8"))
+            data_hash = data_hash.hexdigest()
+
+            hash_file = outfile + ".sha256"
+
+            if os.path.exists(outfile) and os.path.exists(hash_file):
+
+                with open(hash_file, "r", encoding="utf-8") as temp_file:
+
+                    if temp_file.read() == data_hash:
+                        print(f"{outfile} is unchanged.")
+                        return
+
+            plot_function(df)
+
+            with open(hash_file, "w", encoding="utf-8") as temp_file:
+                temp_file.write(data_hash)
+
+        return wrapper
+
+    return decorator
 
 
 def get_confirmed_by_state(df):
@@ -39,32 +143,33 @@ def get_confirmed_by_state(df):
     """
 
     # Only take into account confirmed cases.
-    df = df[df["RESULTADO"] == "Positivo SARS-CoV-2"]
+    df = df[df[RESULT_COLUMN] == POSITIVE_RESULT]
 
     # We will use this value to calculate the percentages.
     total_cases = len(df)
 
-    # We pivot the table, we will use the gender as our columns and the state as our index.
-    pivoted_df = df.pivot_table(
-        index="ENTIDAD_RES", columns="SEXO", aggfunc="count")
+    # We count the cases by state and gender, we will use the gender as our columns and the state as our index.
+    counts_df = pd.crosstab(df["ENTIDAD_RES"], df["SEXO"])
 
-    # From this MultiIndex DataFrame we will add two columns to the age column.
-    # These columns will have the total percentage by state and gender.
-    pivoted_df["EDAD", "female_percentage"] = np.round(
-        pivoted_df["EDAD", "MUJER"] / total_cases * 100, 2)
+    # We add two columns with the total percentage by state and gender.
+    counts_df["female_percentage"] = (
+        counts_df["MUJER"] / total_cases * 100).round(2)
 
-    pivoted_df["EDAD", "male_percentage"] = np.round(
-        pivoted_df["EDAD", "HOMBRE"] / total_cases * 100, 2)
+    counts_df["male_percentage"] = (
+        counts_df["HOMBRE"] / total_cases * 100).round(2)
 
     # We rename the columns so they are human readable.
-    pivoted_df.rename(columns={"HOMBRE": "Male",
-                               "MUJER": "Female",
-                               "male_percentage": "Male %",
-                               "female_percentage": "Female %"}, level=1, inplace=True)
+    counts_df = counts_df.rename(columns={"HOMBRE": "Male",
+                                          "MUJER": "Female",
+                                          "male_percentage": "Male %",
+                                          "female_percentage": "Female %"})
+
+    counts_df.columns.name = None
 
-    print(pivoted_df["EDAD"].to_markdown())
+    print(counts_df.to_markdown())
 
 
+@cached_plot("mexico_symptoms_growth.png", [RESULT_COLUMN, "FECHA_SINTOMAS"])
 def plot_daily_symptoms_growth(df):
     """Plots the daily initial symptoms growth and daily counts.
 
@@ -76,25 +181,22 @@ def plot_daily_symptoms_growth(df):
     """
 
     # Only take into account confirmed cases.
-    df = df[df["RESULTADO"] == "Positivo SARS-CoV-2"]
+    df = df[df[RESULT_COLUMN] == POSITIVE_RESULT]
 
-    # We group our DataFrame by day of initial symptoms and aggregate them by number of ocurrences.
-    grouped_df = df.groupby("FECHA_SINTOMAS").count()
+    # We group our DataFrame by day of initial symptoms and count the number of ocurrences.
+    daily_counts = df.groupby("FECHA_SINTOMAS").size()
 
-    # Convert the index to datetime.
-    grouped_df.index = pd.to_datetime(grouped_df.index)
+    # We also need the cumulative sum of the previous counts.
+    cumulative_counts = daily_counts.cumsum()
 
-    # We add a new column that will hold the cumulative sum of the previous counts.
-    grouped_df["cumsum"] = grouped_df["SECTOR"].cumsum()
-
-    # We create a basic line plot with the previously created column.
+    # We create a basic line plot with the previously created series.
     fig, (ax1, ax2) = plt.subplots(2)
 
-    ax1.plot(grouped_df.index, grouped_df["cumsum"],
-             label="Initial Symptoms Growth", color="lime")
+    ax1.plot(cumulative_counts.index, cumulative_counts,
+             label="Initial Symptoms Growth", color="lime", rasterized=True)
 
-    ax2.plot(grouped_df.index, grouped_df["SECTOR"],
-             label="Initial Symptoms Counts", color="gold")
+    ax2.plot(daily_counts.index, daily_counts,
+             label="Initial Symptoms Counts", color="gold", rasterized=True)
 
     # Ticker customizations. The y-axis will be formatted with month and day.
     ax1.xaxis.set_major_locator(ticker.MaxNLocator(15))
@@ -117,7 +219,7 @@ def plot_daily_symptoms_growth(df):
     ax2.legend(loc=2)
     ax2.set_ylabel("COVID-19 Positive Tests", labelpad=15)
 
-    plt.savefig("mexico_symptoms_growth.png", facecolor="#232b2b")
+    plt.savefig("mexico_symptoms_growth.png", facecolor="#232b2b", dpi=100)
 
 
 def plot_daily_deaths_growth(df):
@@ -131,26 +233,23 @@ def plot_daily_deaths_growth(df):
     """
 
     # Only take into account confirmed cases and deaths.
-    df = df[(df["RESULTADO"] == "Positivo SARS-CoV-2")
-            & (df["FECHA_DEF"] != "9999-99-99")]
-
-    # We group our DataFrame by day of initial symptoms and aggregate them by number of ocurrences.
-    grouped_df = df.groupby("FECHA_DEF").count()
+    df = df[(df[RESULT_COLUMN] == POSITIVE_RESULT)
+            & (df["FECHA_DEF"].notna())]
 
-    # Convert the index to datetime.
-    grouped_df.index = pd.to_datetime(grouped_df.index)
+    # We group our DataFrame by day of death and count the number of ocurrences.
+    daily_counts = df.groupby("FECHA_DEF").size()
 
-    # We add a new column that will hold the cumulative sum of the previous counts.
-    grouped_df["cumsum"] = grouped_df["SECTOR"].cumsum()
+    # We also need the cumulative sum of the previous counts.
+    cumulative_counts = daily_counts.cumsum()
 
-    # We create a basic line plot with the previously created column.
+    # We create a basic line plot with the previously created series.
     fig, (ax1, ax2) = plt.subplots(2)
 
-    ax1.plot(grouped_df.index, grouped_df["cumsum"],
-             label="Deaths Growth", color="lime")
+    ax1.plot(cumulative_counts.index, cumulative_counts,
+             label="Deaths Growth", color="lime", rasterized=True)
 
-    ax2.plot(grouped_df.index, grouped_df["SECTOR"],
-             label="Deaths Counts", color="gold")
+    ax2.plot(daily_counts.index, daily_counts,
+             label="Deaths Counts", color="gold", rasterized=True)
 
     # Ticker customizations. The y-axis will be formatted with month and day.
     ax1.xaxis.set_major_locator(ticker.MaxNLocator(15))
@@ -173,7 +272,7 @@ def plot_daily_deaths_growth(df):
     ax2.legend(loc=2)
     ax2.set_ylabel("COVID-19 Deaths", labelpad=15)
 
-    plt.savefig("mexico_deaths_growth.png", facecolor="#232b2b")
+    plt.savefig("mexico_deaths_growth.png", facecolor="#232b2b", dpi=100)
 
 
 def plot_test_results(df):
@@ -186,24 +285,21 @@ def plot_test_results(df):
 
     """
 
-    # The RESULTADO column has 3 possible values. We create
-    # one column for each one.
-    df["tests"] = 1
+    # We create one column for each of the 3 results we are interested in.
+    # Once the categories are limited to these 3 results their codes are 0, 1 and 2, any other result is -1.
+    # All 3 columns are built at once by comparing each row code against the 3 codes.
+    codes = df[RESULT_COLUMN].cat.set_categories(
+        [POSITIVE_RESULT, NOT_POSITIVE_RESULT, PENDING_RESULT]).cat.codes.to_numpy()
 
-    df["positive"] = df["RESULTADO"].apply(
-        lambda x: 1 if x == "Positivo SARS-CoV-2" else 0)
+    df[["positive", "not_positive", "pending"]] = (
+        codes[:, None] == np.arange(3)).astype(np.int8)
 
-    df["not_positive"] = df["RESULTADO"].apply(
-        lambda x: 1 if x == "No positivo SARS-CoV-2" else 0)
-
-    df["pending"] = df["RESULTADO"].apply(
-        lambda x: 1 if x == "Resultado pendiente" else 0)
+    # Only the rows with one of these results are counted as tests.
+    df["tests"] = df[["positive", "not_positive", "pending"]].sum(axis=1)
 
     # We group the DataFrame by the date of entry and aggregate them by sum.
-    df = df.groupby("FECHA_INGRESO").sum()
-
-    # Convert the index to datetime.
-    df.index = pd.to_datetime(df.index)
+    df = df.groupby("FECHA_INGRESO", sort=False)[
+        ["tests", "positive", "not_positive", "pending"]].sum()
 
     # These percentages will be used for the plots labels.
     total = df["tests"].sum()
@@ -215,13 +311,13 @@ def plot_test_results(df):
     fix, ax = plt.subplots()
 
     ax.bar(df.index, df["positive"], color="#ef6c00",
-           label=f"SARS-CoV-2 Positive ({positive}%)", linewidth=0)
+           label=f"SARS-CoV-2 Positive ({positive}%)", linewidth=0, rasterized=True)
 
     ax.bar(df.index, df["not_positive"], color="#42a5f5",
-           label=f"SARS-CoV-2 Not Positive ({not_positive}%)", bottom=df["positive"] + df["pending"], linewidth=0)
+           label=f"SARS-CoV-2 Not Positive ({not_positive}%)", bottom=df["positive"] + df["pending"], linewidth=0, rasterized=True)
 
     ax.bar(df.index, df["pending"], color="#ffca28",
-           label=f"Pending Result ({pending}%)", bottom=df["positive"], linewidth=0)
+           label=f"Pending Result ({pending}%)", bottom=df["positive"], linewidth=0, rasterized=True)
 
     # Ticker customtzations.
     ax.xaxis.set_major_locator(ticker.MaxNLocator(15))
@@ -236,9 +332,10 @@ def plot_test_results(df):
     plt.ylabel("Number of Daily Results", labelpad=15)
     plt.xlabel("2020", labelpad=15)
 
-    plt.savefig("mexico_tests.png", facecolor="#232b2b")
+    plt.savefig("mexico_tests.png", facecolor="#232b2b", dpi=100)
 
 
+@cached_plot("mexico_age_sex.png", [RESULT_COLUMN, "SEXO", "EDAD"])
 def plot_age_groups(df):
     """Plots the age groups by gender.
 
@@ -249,60 +346,31 @@ def plot_age_groups(df):
 
     """
 
-    # Only take into account confirmed cases.
-    df = df[df["RESULTADO"] == "Positivo SARS-CoV-2"]
-
-    # Create one DataFrame for each gender.
-    male_df = df[df["SEXO"] == "HOMBRE"]
-    female_df = df[df["SEXO"] == "MUJER"]
-
-    # These lists will be used for our bins.
-    age_groups = list()
-    labels = list()
+    # These labels will be used for our bins, our latest bin will be for ages >= 90.
+    labels = [f"{i}-{i+9}" for i in range(0, 90, 10)] + ["≥ 90"]
 
-    for i in range(0, 100, 10):
+    # The bins are 10 years wide, so the age group is the age divided by 10.
+    # The last bin holds everyone from 90 up to 120 years old.
+    ages = df["EDAD"].to_numpy()
+    age_groups = np.minimum(ages // 10, 9)
 
-        # Our latest bin will be for ages >= 90.
-        if i == 90:
-            age_groups.append((i, i+30))
-            labels.append("≥ 90")
-        else:
-            age_groups.append((i, i+9))
-            labels.append("{}-{}".format(i, i+9))
+    # Only take into account confirmed cases, we use NumPy masks instead of slicing the DataFrame.
+    is_counted = (df[RESULT_COLUMN] == POSITIVE_RESULT).to_numpy() & (ages <= 120)
 
-    # We use the previous tuples to build our indexer and slice our DataFrames with it.
-    male_values = list()
-    female_values = list()
+    # We count the rows of each age group and gender, the categories are compared by their codes.
+    is_male = (df["SEXO"] == "HOMBRE").to_numpy() & is_counted
+    is_female = (df["SEXO"] == "MUJER").to_numpy() & is_counted
 
-    for start, end in age_groups:
-        
-        male_values.append(
-            male_df[male_df["EDAD"].between(start, end)]["EDAD"].count())
-
-        female_values.append(
-            female_df[female_df["EDAD"].between(start, end)]["EDAD"].count())
+    male_values = np.bincount(age_groups[is_male], minlength=len(labels))
+    female_values = np.bincount(age_groups[is_female], minlength=len(labels))
 
     fig, ax = plt.subplots()
 
-    bars = ax.bar(
-        [i - 0.225 for i in range(len(labels))], height=male_values,  width=0.45,  color="#1565c0", linewidth=0)
-
-    # This loop creates small texts with the absolute values above each bar (first set of bars).
-    for bar in bars:
-        height = bar.get_height()
-
-        plt.text(bar.get_x() + bar.get_width()/2.0, height * 1.01,
-                 "{:,}".format(height), ha="center", va="bottom")
-
-    bars2 = ax.bar(
-        [i + 0.225 for i in range(len(labels))], height=female_values,  width=0.45,  color="#f06292", linewidth=0)
+    # The male bars go to the left of each tick and the female bars to the right.
+    positions = np.arange(len(labels), dtype=np.float64)
 
-    # This loop creates small texts with the absolute values above each bar (second set of bars).
-    for bar2 in bars2:
-        height2 = bar2.get_height()
-
-        plt.text(bar2.get_x() + bar2.get_width()/2.0, height2 * 1.01,
-                 "{:,}".format(height2), ha="center", va="bottom")
+    draw_grouped_bars(ax, positions - 0.225, male_values, "#1565c0")
+    draw_grouped_bars(ax, positions + 0.225, female_values, "#f06292")
 
     # Ticker customizations.
     ax.yaxis.set_major_locator(ticker.MaxNLocator())
@@ -316,12 +384,77 @@ def plot_age_groups(df):
     plt.xlabel("Age Range", labelpad=15)
     plt.ylabel("Confirmed Cases", labelpad=15)
 
-    plt.savefig("mexico_age_sex.png", facecolor="#232b2b")
+    plt.savefig("mexico_age_sex.png", facecolor="#232b2b", dpi=100)
+
+
+def draw_grouped_bars(ax, positions, values, color):
+    """Draws one set of grouped bars with their absolute values above them.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        The Axes where the bars will be drawn.
+
+    positions : numpy.ndarray
+        The x positions of the bars.
+
+    values : numpy.ndarray
+        The heights of the bars.
+
+    color : str
+        The color of the bars.
+
+    Returns
+    -------
+    matplotlib.container.BarContainer
+        The drawn bars.
+
+    """
+
+    bars = ax.bar(positions, height=values, width=0.45,
+                  color=color, linewidth=0, rasterized=True)
+
+    # Add small texts with the absolute values above each bar.
+    ax.bar_label(bars, fmt="{:,.0f}", padding=2)
+
+    return bars
+
+
+def load_data():
+    """Loads the Mexican dataset, using its Parquet copy when it is up to date.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A DataFrame containing the Mexican data.
+
+    """
+
+    # The Parquet copy is only used when it was made from this exact CSV file and with the same options.
+    # Extracted files can keep an old timestamp, so we compare the size and mtime for equality.
+    csv_stat = os.stat(CSV_FILE)
+    csv_options = json.dumps(CSV_OPTIONS, sort_keys=True)
+    csv_version = [csv_stat.st_size, csv_stat.st_mtime_ns]
+
+    if os.path.exists(PARQUET_FILE):
+        df = pd.read_parquet(PARQUET_FILE)
+
+        if df.attrs.get("csv_options") == csv_options and df.attrs.get("csv_version") == csv_version:
+            return df
+
+    df = pd.read_csv(CSV_FILE, **CSV_OPTIONS)
+
+    # The options and the file version are stored in the Parquet metadata along with the data.
+    df.attrs["csv_options"] = csv_options
+    df.attrs["csv_version"] = csv_version
+    df.to_parquet(PARQUET_FILE)
+
+    return df
 
 
 if __name__ == "__main__":
 
-    main_df = pd.read_csv("mx_data.csv")
+    main_df = load_data()
 
     # get_confirmed_by_state(main_df)
     # plot_daily_symptoms_growth(main_df)